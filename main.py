@@ -1,49 +1,238 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from email.utils import formatdate
+from pathlib import Path
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
+from jinja2 import Environment, FileSystemLoader
+from starlette.datastructures import Headers
 from starlette.requests import Request
-from starlette.responses import RedirectResponse, HTMLResponse, FileResponse
+from starlette.responses import RedirectResponse, HTMLResponse, Response
+from starlette.staticfiles import NotModifiedResponse
 from starlette.templating import Jinja2Templates
+from starlette.types import Scope
+
+# static assets and the favicon share one policy
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as for If-None-Match: W/ prefixes don't matter and * matches anything
+    # that has an etag. an empty one never matches, or stray commas would
+    if not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    # gzip (or *) listed with a non-zero q-value, an explicit gzip entry wins over *
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+class CachedBody:
+    # a response body held in memory. text is gzipped at most once, on the first request
+    # that accepts it (standings pages are 80-150KB of table markup, compresses massively),
+    # images are already compressed so go out as-is. etag is weak as the bytes on the
+    # wire can be gzipped while the content is the same
+    gzip_minimum_size = 500
+
+    def __init__(self, body: bytes, media_type: str, headers: dict, status_code: int = 200):
+        self.body = body
+        self.media_type = media_type
+        self.status_code = status_code
+        self.headers = {**headers, "ETag": 'W/"%s"' % hashlib.md5(body).hexdigest()}
+        self.compressible = media_type.startswith("text/") and len(body) >= self.gzip_minimum_size
+        self.gzipped = None
+        if self.compressible:
+            self.headers["Vary"] = "Accept-Encoding"
+
+    def response(self, request_headers: Headers) -> Response:
+        if self.compressible and accepts_gzip(request_headers.get("accept-encoding", "")):
+            if self.gzipped is None:
+                self.gzipped = gzip.compress(self.body, compresslevel=6)
+            headers = {**self.headers, "Content-Encoding": "gzip"}
+            return Response(
+                self.gzipped, status_code=self.status_code, media_type=self.media_type, headers=headers
+            )
+        return Response(
+            self.body, status_code=self.status_code, media_type=self.media_type, headers=self.headers
+        )
+
+    def not_modified_response(self) -> Response:
+        return NotModifiedResponse(Headers(headers=self.headers))
+
+
+def serve_cached(request_headers: Headers, cached: CachedBody) -> Response:
+    # only a 200 can be revalidated into a 304, error pages are always sent in full
+    if cached.status_code == 200 and etag_matches(request_headers.get("if-none-match", ""), cached.headers["ETag"]):
+        return cached.not_modified_response()
+    return cached.response(request_headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    # keeps the small assets (css, icons, bullets) in memory so they never hit disk,
+    # and tells browsers to hang on to everything for a day.
+    # asset urls aren't content-hashed, so no year-long/immutable caching
+    max_cached_size = 64 * 1024
+    cache_control = STATIC_CACHE_CONTROL
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.in_memory = {}
+        root = Path(directory).resolve()
+        for path in Path(directory).rglob("*"):
+            # is_file is False for dangling symlinks, and like StaticFiles' own lookup
+            # nothing that resolves outside the directory gets served
+            if not path.is_file() or not path.resolve().is_relative_to(root):
+                continue
+            stat_result = path.stat()
+            if stat_result.st_size < self.max_cached_size:
+                media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+                headers = {
+                    "Cache-Control": self.cache_control,
+                    "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+                }
+                self.in_memory[str(path.relative_to(directory))] = CachedBody(
+                    path.read_bytes(), media_type, headers
+                )
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        # the stock check misses * and W/ etags, If-Modified-Since is left to it
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, response_headers.get("etag", ""))
+        return super().is_not_modified(response_headers, request_headers)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        cached = self.in_memory.get(path)
+        if cached is None or scope["method"] not in ("GET", "HEAD"):
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("Cache-Control", self.cache_control)
+            return response
+        request_headers = Headers(scope=scope)
+        if self.is_not_modified(Headers(headers=cached.headers), request_headers):
+            return cached.not_modified_response()
+        return cached.response(request_headers)
+
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+# templates only change on deploy (which restarts the service), so skip jinja's
+# per-render mtime check and keep every compiled template around
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"), autoescape=True, auto_reload=False, cache_size=-1
+    )
+)
+
+# compile everything up front so the first hit on each page doesn't pay for it
+for template_name in templates.env.list_templates():
+    templates.env.get_template(template_name)
 
-templates = Jinja2Templates(directory="templates")
+# none of the pages have per-request context, but url_for bakes the scheme/host
+# into the html, so render each page once per base url and serve the bytes after.
+# base url comes from the Host header. in production nginx drops any Host that isn't
+# one of our server names and passes the port-less $host (see conf/etc/nginx), which
+# keeps the cache bounded. without nginx in front, set EKCX_PAGE_CACHE_HOSTS to a comma
+# separated list of host[:port] to only cache those; other hosts then just get rendered
+PAGE_CACHE_HOSTS = frozenset(
+    host.strip() for host in os.environ.get("EKCX_PAGE_CACHE_HOSTS", "").split(",") if host.strip()
+)
+_page_cache = {}
+
+# pages only change on deploy, so let browsers hold them briefly and revalidate
+# against the etag after that
+PAGE_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=3600"
+
+
+def render_page(
+    request: Request,
+    name: str,
+    context: dict,
+    status_code: int = 200,
+    cache_control: str = PAGE_CACHE_CONTROL,
+) -> Response:
+    # netloc rather than hostname, a port in the Host header changes the links too
+    cacheable = request.url.scheme in ("http", "https") and (
+        not PAGE_CACHE_HOSTS or request.url.netloc in PAGE_CACHE_HOSTS
+    )
+    if not cacheable:
+        # one-off render, not worth an etag or compressing
+        body = templates.env.get_template(name).render(request=request, **context)
+        return HTMLResponse(body, status_code=status_code, headers={"Cache-Control": cache_control})
+    key = (name, str(request.base_url), tuple(sorted(context.items())))
+    cached = _page_cache.get(key)
+    if cached is None:
+        body = templates.env.get_template(name).render(request=request, **context).encode()
+        cached = _page_cache[key] = CachedBody(
+            body, "text/html", {"Cache-Control": cache_control}, status_code=status_code
+        )
+    return serve_cached(request.headers, cached)
 
 
 @app.get("/")
 async def main_route(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="home.html", context={"selected": "home"}
-    )
+    return render_page(request, "home.html", {"selected": "home"})
+
+# favicon.ico was never checked in, head.html points browsers at the logo jpg
+favicon_path = 'static/images/ekcx.jpg'
+favicon_body = CachedBody(
+    Path(favicon_path).read_bytes(), "image/jpeg", {"Cache-Control": STATIC_CACHE_CONTROL}
+)
 
-favicon_path = 'favicon.ico'
 
+@app.get('/favicon.ico', include_in_schema=False)
+async def favicon(request: Request):
+    return serve_cached(request.headers, favicon_body)
 
-@app.get('/static/images/ekcx.jpg', include_in_schema=False)
-async def favicon():
-    return FileResponse(favicon_path)
+
+STANDINGS_CATEGORIES = frozenset(
+    Path(name).stem for name in templates.env.list_templates() if name.startswith("standings/")
+)
+# bots hammer made-up urls, the not found page is cached like any other and they can
+# hold on to it for longer
+NOT_FOUND_CACHE_CONTROL = "public, max-age=3600"
 
 
 @app.get("/standings/{category}", response_class=HTMLResponse)
 async def standings(request: Request, category: str):
-    return templates.TemplateResponse(
-        request=request, name="standings.html", context={"category": category, "selected": "standings"}
-    )
+    if category not in STANDINGS_CATEGORIES:
+        return render_page(
+            request,
+            "not_found.html",
+            {"selected": "standings"},
+            status_code=404,
+            cache_control=NOT_FOUND_CACHE_CONTROL,
+        )
+    return render_page(request, "standings.html", {"category": category, "selected": "standings"})
 
 @app.get("/media/", response_class=HTMLResponse)
 async def media(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="media.html", context={"selected": "media"}
-    )
+    return render_page(request, "media.html", {"selected": "media"})
 
 @app.get("/forum/", response_class=HTMLResponse)
-async def privacy(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="forum.html", context={"selected": "forum"}
-    )
+async def forum(request: Request):
+    return render_page(request, "forum.html", {"selected": "forum"})
 
 @app.get("/privacy/", response_class=HTMLResponse)
 async def privacy(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="privacy.html", context={"selected": "home"}
-    )
+    return render_page(request, "privacy.html", {"selected": "home"})
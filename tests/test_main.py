@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import etag_matches
+
+client = TestClient(main.app)
+
+
+@pytest.fixture(autouse=True)
+def empty_page_cache(monkeypatch):
+    monkeypatch.setattr(main, "_page_cache", {})
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", W/"abc"', 'W/"abc"')
+    assert etag_matches("*", 'W/"abc"')
+    assert not etag_matches('"xyz"', 'W/"abc"')
+    assert not etag_matches(",", "")
+    assert not etag_matches("*", "")
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", '"other", {etag}', "*"])
+def test_page_not_modified(if_none_match):
+    etag = client.get("/").headers["etag"]
+    response = client.get("/", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_page_modified():
+    response = client.get("/", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == main.PAGE_CACHE_CONTROL
+
+
+def test_static_not_modified():
+    response = client.get("/static/style/style.css")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == main.STATIC_CACHE_CONTROL
+
+    response = client.get("/static/style/style.css", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+
+def test_static_if_modified_since():
+    last_modified = client.get("/static/style/style.css").headers["last-modified"]
+    response = client.get("/static/style/style.css", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    response = client.get(
+        "/static/style/style.css", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, gzipped",
+    [("gzip", True), ("br;q=1.0, gzip;q=0.8", True), ("*", True), ("identity", False), ("gzip;q=0", False), ("", False)],
+)
+def test_page_gzip(accept_encoding, gzipped):
+    response = client.get("/", headers={"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert (response.headers.get("content-encoding") == "gzip") == gzipped
+    assert b"East Kent Cyclocross" in response.content
+
+
+def test_images_not_gzipped():
+    for url, path in [("/static/style/bullet.png", "static/style/bullet.png"), ("/favicon.ico", "static/images/ekcx.jpg")]:
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert int(response.headers["content-length"]) == Path(path).stat().st_size
+
+
+def test_page_cache_host_gated(monkeypatch):
+    monkeypatch.setattr(main, "PAGE_CACHE_HOSTS", frozenset({"ekcx.co.uk"}))
+
+    response = client.get("/", headers={"Host": "ekcx.co.uk"})
+    assert response.status_code == 200
+    assert "etag" in response.headers
+    assert len(main._page_cache) == 1
+
+    response = client.get("/", headers={"Host": "elsewhere.example", "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert "content-encoding" not in response.headers
+    assert b"http://elsewhere.example/static/" in response.content
+    assert len(main._page_cache) == 1
+
+
+def test_standings_not_found():
+    response = client.get("/standings/nonsense")
+    assert response.status_code == 404
+    assert response.headers["cache-control"] == main.NOT_FOUND_CACHE_CONTROL
+    assert b"East Kent Cyclocross - Not Found" in response.content
+    assert b'href="/standings/v50"' in response.content
+
+    # the 404 is never turned into a 304
+    response = client.get("/standings/nonsense", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 404
+
+
+def test_standings_found():
+    response = client.get("/standings/v50")
+    assert response.status_code == 200
@@ -1,5 +1,8 @@
 from uvicorn.workers import UvicornWorker
 
+# gunicorn runs with --preload (see ekcx.service), so main.py is imported once in the
+# master and the compiled templates/in-memory static files are shared copy-on-write.
+# keep main.py import-time work preload safe: no sockets, threads or open files
 class MyUvicornWorker(UvicornWorker):
     # doing this to try and fix style.css being http rather than https
     # not sure if this was necessary, or fixing the nginx conf